@@ -19,50 +19,63 @@
 #
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
+import bisect
 import ipaddress
 from Exceptions import AssignmentException
 
 class AddressAssigner():
 	def __init__(self, root_network):
 		self._root_network = root_network
-		self._assignable = [ self._root_network ]
+		# Assignable addresses as disjoint, sorted and inclusive (start, end)
+		# integer ranges; address objects are only created when handed out.
+		self._ranges_int = [ (int(self._root_network.network_address), int(self._root_network.broadcast_address)) ]
+		self._range_starts = [ start for (start, end) in self._ranges_int ]
 		self.exclude_address(self._root_network.network_address)
 		self.exclude_address(self._root_network.broadcast_address)
-		self._net_index = 0
-		self._addr_index = 0
+		self._range_index = 0
+		self._range_offset = 0
 
 	@property
 	def root_network(self):
 		return self._root_network
 
 	def assign(self):
-		try:
-			address = self._assignable[self._net_index][self._addr_index]
-		except IndexError:
-			self._addr_index = 0
-			self._net_index += 1
-			try:
-				address = self._assignable[self._net_index][self._addr_index]
-			except IndexError:
-				raise AssignmentException(f"Ran out of IP addresses for network {self._root_network}.")
-		self._addr_index += 1
+		if (self._range_index < len(self._ranges_int)) and (self._ranges_int[self._range_index][0] + self._range_offset > self._ranges_int[self._range_index][1]):
+			self._range_index += 1
+			self._range_offset = 0
+		if self._range_index >= len(self._ranges_int):
+			raise AssignmentException(f"Ran out of IP addresses for network {self._root_network}.")
+		address = self._root_network.network_address.__class__(self._ranges_int[self._range_index][0] + self._range_offset)
+		self._range_offset += 1
 		return address
 
 	def exclude_address(self, address):
-		if address.version != self._root_network.version:
-			return
 		return self.exclude_net(ipaddress.ip_network(address))
 
-	def exclude_net(self, network):
-		still_assignable = [ ]
-		for assignable in self._assignable:
-			try:
-				still_assignable += assignable.address_exclude(network)
-			except ValueError:
+	def _exclude_range(self, exclude_start, exclude_end):
+		# Ranges are disjoint and kept sorted, so only the one containing the
+		# start of the excluded range and those starting within it can
+		# possibly overlap.
+		first = max(bisect.bisect_right(self._range_starts, exclude_start) - 1, 0)
+		last = bisect.bisect_right(self._range_starts, exclude_end)
+		remaining = [ ]
+		for (start, end) in self._ranges_int[first : last]:
+			if (end < exclude_start) or (start > exclude_end):
 				# Non overlap
-				still_assignable.append(assignable)
-		self._assignable = still_assignable
-		self._assignable.sort()
+				remaining.append((start, end))
+				continue
+			if start < exclude_start:
+				remaining.append((start, exclude_start - 1))
+			if end > exclude_end:
+				remaining.append((exclude_end + 1, end))
+		self._ranges_int[first : last] = remaining
+		self._range_starts[first : last] = [ start for (start, end) in remaining ]
+
+	def exclude_net(self, network):
+		if (network.version != self._root_network.version) or (not network.overlaps(self._root_network)):
+			# Nothing to exclude, the network lies outside of the root network
+			return
+		self._exclude_range(int(network.network_address), int(network.broadcast_address))
 
 	@classmethod
 	def parse(cls, definition):
@@ -19,30 +19,56 @@
 #
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
+import io
 import os
+import time
 import tarfile
+import concurrent.futures
 
 class ArchivePacker():
-	def __init__(self, wggen):
+	def __init__(self, wggen, output_files):
 		self._wggen = wggen
+		# Host name -> { filename: content } of everything written to that
+		# host's output directory
+		self._output_files = output_files
+		self._host_dirs = { host["name"]: self._wggen.get_output_directory(host["name"]) for host in self._wggen.hosts }
+
+	def _add_directory(self, f, arcname, files, mtime):
+		dirinfo = tarfile.TarInfo(arcname)
+		dirinfo.type = tarfile.DIRTYPE
+		dirinfo.mode = 0o700
+		dirinfo.mtime = mtime
+		f.addfile(dirinfo)
+		for (filename, content) in sorted(files.items()):
+			fileinfo = tarfile.TarInfo(f"{arcname}/{filename}")
+			fileinfo.size = len(content)
+			fileinfo.mode = 0o600
+			fileinfo.mtime = mtime
+			f.addfile(fileinfo, io.BytesIO(content))
+
+	def _get_archive_directory(self, hostname):
+		return (os.path.basename(self._host_dirs[hostname]), self._output_files[hostname])
 
 	def _create_tar_gz(self, destination_filename, included_directories):
-		with tarfile.open(destination_filename, "w|gz") as f:
-			for dirname in included_directories:
-				arcname = os.path.basename(dirname)
-				f.add(dirname, arcname = arcname)
+		# Archives are small, so better compression is not worth the CPU time.
+		mtime = time.time()
+		with tarfile.open(destination_filename, "w:gz", compresslevel = 1) as f:
+			for (arcname, files) in included_directories:
+				self._add_directory(f, arcname, files, mtime)
 
 	def _create_host_archive(self, hostname):
-		outdir = self._wggen.get_output_directory(hostname)
-		return self._create_tar_gz(outdir + ".tar.gz", [ outdir ])
+		outdir = self._host_dirs[hostname]
+		return self._create_tar_gz(outdir + ".tar.gz", [ self._get_archive_directory(hostname) ])
 
 	def create_all_host_archives(self):
-		for host in self._wggen.hosts:
-			self._create_host_archive(host["name"])
+		with concurrent.futures.ThreadPoolExecutor(max_workers = os.cpu_count()) as executor:
+			futures = [ executor.submit(self._create_host_archive, host["name"]) for host in self._wggen.hosts ]
+			for future in concurrent.futures.as_completed(futures):
+				future.result()
 
 	def create_group_archives(self):
 		for (group_name, members) in self._wggen.groups:
 			targz_filename = self._wggen.get_output_directory(group_name) + ".tar.gz"
-			outdirs = [ self._wggen.get_output_directory(host["name"]) for host in members ]
-			outdirs.sort()
-			self._create_tar_gz(targz_filename, outdirs)
+			included_directories = [ self._get_archive_directory(host["name"]) for host in members ]
+			included_directories.sort(key = lambda entry: entry[0])
+			self._create_tar_gz(targz_filename, included_directories)
@@ -19,6 +19,7 @@
 #
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
+import io
 import os
 import datetime
 import contextlib
@@ -29,6 +30,7 @@ class ConfigGenerator():
 		self._wggen = wggen
 		self._host = host
 		self._output_directory = output_directory
+		self._files = { }
 		with contextlib.suppress(FileExistsError):
 			os.makedirs(self._output_directory)
 		os.chmod(self._output_directory, 0o700)
@@ -53,6 +55,14 @@ class ConfigGenerator():
 	def pubkey_filename(self):
 		return f"{self._output_directory}/{self.ifname}-public.key"
 
+	def _read_key(self, filename):
+		# Keeps the file content around so that archives can be created
+		# without reading the output directory back in
+		with open(filename, "rb") as f:
+			content = f.read()
+		self._files[os.path.basename(filename)] = content
+		return content.decode("ascii").rstrip("\r\n")
+
 	def generate_keys(self):
 		self._host["key"] = { }
 
@@ -60,16 +70,14 @@ class ConfigGenerator():
 			privkey = subprocess.check_output([ "wg", "genkey" ])
 			with open(self.privkey_filename, "wb") as f:
 				f.write(privkey)
-		with open(self.privkey_filename) as f:
-			privkey = f.read().rstrip("\r\n")
+		privkey = self._read_key(self.privkey_filename)
 		self._host["key"]["private"] = privkey
 
 		if not os.path.exists(self.pubkey_filename):
 			pubkey = subprocess.check_output([ "wg", "pubkey" ], input = privkey.encode("ascii"))
 			with open(self.pubkey_filename, "wb") as f:
 				f.write(pubkey)
-		with open(self.pubkey_filename) as f:
-			pubkey = f.read().rstrip("\r\n")
+		pubkey = self._read_key(self.pubkey_filename)
 		self._host["key"]["public"] = pubkey
 
 	def _get_assigned_addresses(self, host, only_host = False):
@@ -102,7 +110,7 @@ class ConfigGenerator():
 			print(file = f)
 
 	def generate(self):
-		with open(self.config_filename, "w") as f:
+		with io.StringIO() as f:
 			print("# WireGuard configuration generated by https://github.com/johndoe31415/lazywireguard", file = f)
 			print(f"# {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", file = f)
 			print(f"# Endpoint \"{self.endpoint_name}\" of source file: {os.path.basename(self._wggen.config_filename)}", file = f)
@@ -124,3 +132,9 @@ class ConfigGenerator():
 				self._generate_peer_server(f)
 			else:
 				self._generate_peer_client(f)
+			content = f.getvalue().encode("utf-8")
+
+		with open(self.config_filename, "wb") as f:
+			f.write(content)
+		self._files[os.path.basename(self.config_filename)] = content
+		return self._files
@@ -29,6 +29,15 @@ from Exceptions import RuleParseException, NoSuchGroupException
 class IPTablesRule():
 	_RULE_SYNTAX = re.compile(r"(?P<lhs>[^\s]+)\s+(?P<arrow>(<-|->|<->|<=|=>|<=>))\s+(?P<rhs>[^\s]+)")
 	_ParsedSide = collections.namedtuple("ParsedSide", [ "bind_interface", "networks" ])
+	# Maps each arrow to its normalized form and whether both sides need to be swapped
+	_ARROW_NORMALIZE = {
+		"->":	("->", False),
+		"<-":	("->", True),
+		"<->":	("<->", False),
+		"=>":	("=>", False),
+		"<=":	("=>", True),
+		"<=>":	("<=>", False),
+	}
 
 	def __init__(self, wggen, rule_str):
 		self._wggen = wggen
@@ -36,6 +45,10 @@ class IPTablesRule():
 		self._lhs = None
 		self._rhs = None
 		self._arrow = None
+		self._lhs_v4_strs = None
+		self._lhs_v6_strs = None
+		self._rhs_v4_strs = None
+		self._rhs_v6_strs = None
 		self._parse_rule()
 
 	@property
@@ -50,16 +63,26 @@ class IPTablesRule():
 		match = self._RULE_SYNTAX.fullmatch(self._rule_str)
 		if match is None:
 			raise RuleParseException(f"Unable to parse routing rule: {self._rule_str}")
-		match = match.groupdict()
+		(lhs, arrow, rhs) = match.group("lhs", "arrow", "rhs")
 
-		if match["arrow"] == "<-":
-			(match["lhs"], match["arrow"], match["rhs"]) = (match["rhs"], "->", match["lhs"])
-		elif match["arrow"] == "<=":
-			(match["lhs"], match["arrow"], match["rhs"]) = (match["rhs"], "=>", match["lhs"])
+		(self._arrow, swap) = self._ARROW_NORMALIZE[arrow]
+		if swap:
+			(lhs, rhs) = (rhs, lhs)
 
-		self._lhs = self._resolve(match["lhs"])
-		self._arrow = match["arrow"]
-		self._rhs = self._resolve(match["rhs"])
+		self._lhs = self._resolve(lhs)
+		self._rhs = self._resolve(rhs)
+
+		self._lhs_v4_strs = self._format_networks_of_version(self._lhs.networks, 4)
+		self._lhs_v6_strs = self._format_networks_of_version(self._lhs.networks, 6)
+		self._rhs_v4_strs = self._format_networks_of_version(self._rhs.networks, 4)
+		self._rhs_v6_strs = self._format_networks_of_version(self._rhs.networks, 6)
+
+	@staticmethod
+	def _format_networks_of_version(networks, version):
+		# Returns the text forms of all networks of the given IP version, so
+		# that each one is only formatted once and not for every command it
+		# appears in. None ("everywhere") applies to both IP versions.
+		return [ str(network) if (network is not None) else None for network in networks if (network is None) or (network.version == version) ]
 
 	def _resolve(self, symbol):
 		if symbol == "*":
@@ -70,15 +93,11 @@ class IPTablesRule():
 			return self._ParsedSide(bind_interface = False, networks = [ network ])
 		elif symbol.startswith("@"):
 			# Whole group
-			networks = [ ]
-			group_name = symbol[1:]
-			for member in self._wggen.get_group_members(group_name):
-				networks += member["assigned"]
-			return self._ParsedSide(bind_interface = True, networks = networks)
+			return self._ParsedSide(bind_interface = True, networks = self._wggen.get_group_networks(symbol[1:]))
 		else:
-			return self._ParsedSide(bind_interface = True, networks = self._wggen.get_host(symbol)["assigned"])
+			return self._ParsedSide(bind_interface = True, networks = self._wggen.get_host_networks(symbol))
 
-	def _iptables_rule(self, src, dst, is_ipv4 = False, in_ifname = None, out_ifname = None, only_established = False):
+	def _iptables_rule(self, src_str, dst_str, is_ipv4 = False, in_ifname = None, out_ifname = None, only_established = False):
 		if is_ipv4:
 			cmd = [ "iptables" ]
 		else:
@@ -91,83 +110,51 @@ class IPTablesRule():
 			cmd += [ "-i", in_ifname ]
 		if out_ifname is not None:
 			cmd += [ "-o", out_ifname ]
-		if src is not None:
-			cmd += [ "-s", str(src) ]
-		if dst is not None:
-			cmd += [ "-d", str(dst) ]
+		if src_str is not None:
+			cmd += [ "-s", src_str ]
+		if dst_str is not None:
+			cmd += [ "-d", dst_str ]
 		cmd += [ "-j", "ACCEPT" ]
 		rule_text = self._rule_str if (not only_established) else f"only established: {self._rule_str}"
 		cmd += [ "-m", "comment", "--comment", rule_text ]
 		return cmd
 
-	def _iptables_rules(self, ifname, src, dst, only_established = False):
-		srcs = self._resolve_routing_target(src)
-		dsts = self._resolve_routing_target(dst)
-		for (ipsrc, ipdst) in itertools.product(srcs, dsts):
-			yield self._iptables_rule(ifname, ipsrc, ipdst, only_established)
-
-	def _generate_routing_table(self):
-		host = self._config["concentrator"]
-		ifname = host.get("ifname", "wg0")
-		dirname = self.output_dir + "/" + host["name"]
-		filename = f"{dirname}/iptables.sh"
-		with open(filename, "w") as f:
-			cle = CmdlineEscape()
-			print("#!/bin/bash", file = f)
-			for rule in self._config.get("route", [ ]):
-				match = self._RULE_SYNTAX.fullmatch(rule)
-				if match is None:
-					raise Exception(f"Unable to parse routing rule: {rule}")
-				match = match.groupdict()
-
-				if match["arrow"] == "<-":
-					(match["lhs"], match["arrow"], match["rhs"]) = (match["rhs"], "->", match["lhs"])
-
-				uni_directional = (match["arrow"] == "->")
-				if uni_directional:
-					# Initial packets are okay, but we only route back estalibshed/related connections
-					for rule in self._iptables_rules(ifname, match["lhs"], match["rhs"]):
-						print(cle.cmdline(rule), file = f)
-					for rule in self._iptables_rules(ifname, match["rhs"], match["lhs"], only_established = True):
-						print(cle.cmdline(rule), file = f)
-				else:
-					print(cle.cmdline(self._iptables_rule(ifname, match["lhs"], match["rhs"])), file = f)
-					print(cle.cmdline(self._iptables_rule(ifname, match["rhs"], match["lhs"])), file = f)
-
-	def _iterate_ipversion_commands(self, is_ipv4, predicate):
-		all_lhs = [ element for element in self._lhs.networks if predicate(element) ]
-		all_rhs = [ element for element in self._rhs.networks if predicate(element) ]
-
+	def _iterate_ipversion_commands(self, is_ipv4, all_lhs, all_rhs):
 		ifname = self._wggen.concentrator.get("ifname", "wg0")
+		if self.only_wg_interface:
+			in_ifname = ifname
+			out_ifname = ifname
+		else:
+			in_ifname = ifname if self._lhs.bind_interface else None
+			out_ifname = ifname if self._rhs.bind_interface else None
 
 		for (lhs, rhs) in itertools.product(all_lhs, all_rhs):
-			if self.only_wg_interface:
-				in_ifname = ifname
-				out_ifname = ifname
-			else:
-				in_ifname = ifname if self._lhs.bind_interface else None
-				out_ifname = ifname if self._rhs.bind_interface else None
-			yield self._iptables_rule(src = lhs, dst = rhs, is_ipv4 = is_ipv4, in_ifname = in_ifname, out_ifname = out_ifname)
-			yield self._iptables_rule(src = rhs, dst = lhs, is_ipv4 = is_ipv4, in_ifname = out_ifname, out_ifname = in_ifname, only_established = not self.bidirectional)
+			yield self._iptables_rule(src_str = lhs, dst_str = rhs, is_ipv4 = is_ipv4, in_ifname = in_ifname, out_ifname = out_ifname)
+			yield self._iptables_rule(src_str = rhs, dst_str = lhs, is_ipv4 = is_ipv4, in_ifname = out_ifname, out_ifname = in_ifname, only_established = not self.bidirectional)
 
 	def _iterate_commands(self):
-		yield from self._iterate_ipversion_commands(is_ipv4 = True, predicate = lambda addr: (addr is None) or (addr.version == 4))
-		yield from self._iterate_ipversion_commands(is_ipv4 = False, predicate = lambda addr: (addr is None) or (addr.version == 6))
+		yield from self._iterate_ipversion_commands(is_ipv4 = True, all_lhs = self._lhs_v4_strs, all_rhs = self._rhs_v4_strs)
+		yield from self._iterate_ipversion_commands(is_ipv4 = False, all_lhs = self._lhs_v6_strs, all_rhs = self._rhs_v6_strs)
 
-	def generate(self, f):
+	def generate(self):
 		cle = CmdlineEscape()
-		print(f"# {self._rule_str}", file = f)
+		yield f"# {self._rule_str}"
 		for command in self._iterate_commands():
-			print(cle.cmdline(command), file = f)
-		print(file = f)
+			yield cle.cmdline(command)
+		yield ""
 
 class IPTablesRulesGenerator():
 	def __init__(self, wggen):
 		self._wggen = wggen
 
+	def _generate_lines(self):
+		yield "#!/bin/bash"
+		for rule in self._wggen.routing_rules:
+			parsed_rule = IPTablesRule(self._wggen, rule)
+			yield from parsed_rule.generate()
+
 	def generate(self, filename):
-		with open(filename, "w") as f:
-			print("#!/bin/bash", file = f)
-			for rule in self._wggen.routing_rules:
-				parsed_rule = IPTablesRule(self._wggen, rule)
-				parsed_rule.generate(f)
+		content = "".join(line + "\n" for line in self._generate_lines()).encode("utf-8")
+		with open(filename, "wb", buffering = 1024 * 1024) as f:
+			f.write(content)
+		return content
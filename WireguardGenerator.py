@@ -19,35 +19,46 @@
 #
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
-import json
-import itertools
+import os
+import bisect
+import concurrent.futures
 import ipaddress
-import collections
 from AddressAssigner import AddressAssigner
 from ConfigGenerator import ConfigGenerator
 from IPTablesRulesGenerator import IPTablesRulesGenerator
 from ArchivePacker import ArchivePacker
-from Exceptions import NetworkOverlapException, DuplicateNameException, InvalidFixedAddressException, NoSuchHostException
+from Exceptions import NetworkOverlapException, DuplicateNameException, InvalidFixedAddressException, NoSuchHostException, NoSuchGroupException
+
+try:
+	import orjson as json_parser
+except ImportError:
+	import json as json_parser
 
 class WireguardGenerator():
 	def __init__(self, args):
 		self._args = args
-		with open(self.config_filename) as f:
-			self._config = json.load(f)
+		with open(self.config_filename, "rb") as f:
+			self._config = json_parser.loads(f.read())
 		self._networks = [ AddressAssigner.parse(network) for network in self._config["topology"]["networks"] ]
 		self._routed = [ ipaddress.ip_network(network) for network in self._config["topology"].get("routed", [ ]) ]
 		self._check_networks_have_no_overlap()
+		self._net_bounds_v4 = self._get_network_bounds(4)
+		self._net_starts_v4 = [ start for (start, end, index) in self._net_bounds_v4 ]
+		self._net_bounds_v6 = self._get_network_bounds(6)
+		self._net_starts_v6 = [ start for (start, end, index) in self._net_bounds_v6 ]
 		self._resolve_iteration_clients()
-		self._check_no_duplicate_name()
+		self._hosts = [ self.concentrator ] + self.clients
+		self._hosts_by_name = self._determine_hosts_by_name()
 		self._assign_server_client_fields()
 		self._reserve_fixed_addresses()
 		self._check_duplicate_fixed_addresses()
+		self._groups = { }
 		self._assign_addresses()
 		self._assign_default_server_port()
 
-		self._hosts_by_name = { host["name"]: host for host in self.hosts }
-		self._groups = self._determine_groups()
-		self._any_ipv6_used = any(isinstance(network.root_network, ipaddress.IPv6Network) for network in self._networks)
+		self._host_networks = { host["name"]: tuple(host["assigned"]) for host in self.hosts }
+		self._group_networks = { group_name: tuple(address for member in members for address in member["assigned"]) for (group_name, members) in self.groups }
+		self._any_ipv6_used = len(self._net_bounds_v6) > 0
 
 	@property
 	def config_filename(self):
@@ -87,25 +98,52 @@ class WireguardGenerator():
 			raise NoSuchGroupException(f"Group with name \"{group_name}\" not defined.")
 		return self._groups[group_name]
 
+	def get_host_networks(self, name):
+		if name not in self._host_networks:
+			raise NoSuchHostException(f"Host with name \"{name}\" not defined.")
+		return self._host_networks[name]
+
+	def get_group_networks(self, group_name):
+		if group_name not in self._group_networks:
+			raise NoSuchGroupException(f"Group with name \"{group_name}\" not defined.")
+		return self._group_networks[group_name]
+
+	def _get_network_bounds(self, version):
+		return sorted((int(network.root_network.network_address), int(network.root_network.broadcast_address), index) for (index, network) in enumerate(self._networks) if network.root_network.version == version)
+
 	def _get_network_index(self, address):
-		for (index, net) in enumerate(self._networks):
-			if address in net.root_network:
-				return index
+		if address.version == 4:
+			(bounds, starts) = (self._net_bounds_v4, self._net_starts_v4)
+		else:
+			(bounds, starts) = (self._net_bounds_v6, self._net_starts_v6)
+		address_int = int(address)
+		pos = bisect.bisect_right(starts, address_int) - 1
+		if (pos >= 0) and (address_int <= bounds[pos][1]):
+			return bounds[pos][2]
 		return None
 
 	def _check_networks_have_no_overlap(self):
 		checked_networks = [ ("network", assigner.root_network) for assigner in self._networks ]
 		checked_networks += [ ("routed network", network) for network in self._routed ]
 
-		for ((text1, net1), (text2, net2)) in itertools.combinations(checked_networks, 2):
-			if net1.overlaps(net2):
-				raise NetworkOverlapException(f"Networks may not overlap, but {net1} {text1} overlaps {net2} {text2}.")
-
-	def _check_no_duplicate_name(self):
-		seen_names = set()
+		# IPv4 and IPv6 networks can never overlap each other. Within one
+		# address family networks either nest or are disjoint, so when sorted
+		# by their start address any overlap shows up between two neighbors.
+		entries_by_version = { 4: [ ], 6: [ ] }
+		for (text, net) in checked_networks:
+			entries_by_version[net.version].append((int(net.network_address), int(net.broadcast_address), text, net))
+		for entries in entries_by_version.values():
+			entries.sort(key = lambda entry: entry[0])
+			for ((start1, end1, text1, net1), (start2, end2, text2, net2)) in zip(entries, entries[1:]):
+				if start2 <= end1:
+					raise NetworkOverlapException(f"Networks may not overlap, but {net1} {text1} overlaps {net2} {text2}.")
+
+	def _determine_hosts_by_name(self):
+		hosts_by_name = { }
 		for host in self.hosts:
-			if host["name"] in seen_names:
+			if hosts_by_name.setdefault(host["name"], host) is not host:
 				raise DuplicateNameException(f"Hostname \"{host['name']}\" used twice. Must be unique.")
+		return hosts_by_name
 
 	def _resolve_iteration_clients(self):
 		clients = [ ]
@@ -128,38 +166,37 @@ class WireguardGenerator():
 		for client in self.clients:
 			client["server"] = False
 
-	def _reserve_fixed_address(self, address):
+	def _reserve_fixed_address(self, host, address):
 		address = ipaddress.ip_address(address)
-		for network in self._networks:
-			network.exclude_address(address)
-		return address
+		index = self._get_network_index(address)
+		if index is None:
+			raise InvalidFixedAddressException(f"Host \"{host['name']}\" has invalid address {address} which falls into none of the networks.")
+		self._networks[index].exclude_address(address)
+		return (index, address)
 
 	def _reserve_fixed_addresses(self):
 		for host in self.hosts:
 			addresses = [ ]
 			if "address" in host:
 				if isinstance(host["address"], str):
-					addresses.append(self._reserve_fixed_address(host["address"]))
+					addresses.append(self._reserve_fixed_address(host, host["address"]))
 				else:
 					for address in host["address"]:
-						addresses.append(self._reserve_fixed_address(address))
+						addresses.append(self._reserve_fixed_address(host, address))
 				del host["address"]
 			host["fixed_address"] = addresses
 
 	def _check_duplicate_fixed_addresses(self):
 		seen = set()
 		for host in self.hosts:
-			for address in host["fixed_address"]:
+			for (index, address) in host["fixed_address"]:
 				if address in seen:
 					raise InvalidFixedAddressException(f"Host \"{host['name']}\" has invalid address {address} which has been assigned to another host already.")
 				seen.add(address)
 
 	def _assign_host_address(self, host):
 		assigned = [ None ] * len(self._networks)
-		for address in host["fixed_address"]:
-			index = self._get_network_index(address)
-			if index is None:
-				raise InvalidFixedAddressException(f"Host \"{host['name']}\" has invalid address {address} which falls into none of the networks.")
+		for (index, address) in host["fixed_address"]:
 			if assigned[index] is not None:
 				raise InvalidFixedAddressException(f"Host \"{host['name']}\" has already duplicate assignment with address {address}; the same network has already been specified.")
 			assigned[index] = address
@@ -168,6 +205,8 @@ class WireguardGenerator():
 			if assigned_address is None:
 				assigned[index] = self._networks[index].assign()
 		host["assigned"] = assigned
+		if "group" in host:
+			self._groups.setdefault(host["group"], [ ]).append(host)
 
 	def _assign_addresses(self):
 		for host in self.hosts:
@@ -177,26 +216,17 @@ class WireguardGenerator():
 		if "port" not in self.concentrator:
 			self.concentrator["port"] = 51820
 
-	def _determine_groups(self):
-		groups = collections.defaultdict(list)
-		for host in self.hosts:
-			if "group" in host:
-				group_name = host["group"]
-				groups[group_name].append(host)
-		return groups
-
 	@property
 	def concentrator(self):
 		return self._config["concentrator"]
 
 	@property
 	def clients(self):
-		yield from self._config["clients"]
+		return self._config["clients"]
 
 	@property
 	def hosts(self):
-		yield self.concentrator
-		yield from self.clients
+		return self._hosts
 
 	def get_output_directory(self, host_name):
 		if self._args.output_dir is None:
@@ -205,22 +235,25 @@ class WireguardGenerator():
 			return f"{self._args.output_dir}/{host_name}"
 
 	def run(self):
-		# First create all keys (so the public keys for all configs are known)
+		# Every host has its own output directory, so all hosts can be handled
+		# concurrently. First create all keys (so the public keys for all
+		# configs are known)
 		generators = [ ConfigGenerator(self, host, self.get_output_directory(host["name"])) for host in self.hosts ]
-		for generator in generators:
-			generator.generate_keys()
+		with concurrent.futures.ThreadPoolExecutor(max_workers = os.cpu_count()) as executor:
+			list(executor.map(ConfigGenerator.generate_keys, generators))
 
-		# Then, create all configuration files
-		for generator in generators:
-			generator.generate()
+			# Then, create all configuration files
+			output_files = dict(zip((host["name"] for host in self.hosts), executor.map(ConfigGenerator.generate, generators)))
 
 		# For the concentrator, generate the iptables file
 		iptables_filename = self.get_output_directory(self.concentrator["name"]) + "/iptables.sh"
 		iptrg = IPTablesRulesGenerator(self)
-		iptrg.generate(iptables_filename)
+		output_files[self.concentrator["name"]]["iptables.sh"] = iptrg.generate(iptables_filename)
 
-		# Finally, pack up into .tar.gz archives if the user wants that.
-		packer = ArchivePacker(self)
+		# Finally, pack up into .tar.gz archives if the user wants that. They
+		# are created from the contents written above, without reading the
+		# output directories back in.
+		packer = ArchivePacker(self, output_files)
 		if self._args.create_tar_gz:
 			packer.create_all_host_archives()
 		if self._args.create_group_tar_gz: